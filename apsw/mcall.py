@@ -4,7 +4,8 @@
 # ciphers and parameters
 
 
-import gc
+import itertools
+import math
 import os
 import random
 from typing import Generator
@@ -56,6 +57,15 @@ for v in ciphers.values():
 
 all_params: tuple[str] = tuple(all_params)
 
+# sorted once up front so the random choices are reproducible from the
+# seed without re-sorting on every iteration
+_cipher_names: tuple[str, ...] = tuple(ciphers.keys())
+_all_params_sorted: tuple[str, ...] = tuple(sorted(all_params))
+_sorted_choices = {
+    c: {p: tuple(sorted(v)) if isinstance(v, set) else v for p, v in params.items()} for c, params in ciphers.items()
+}
+_cipher_keyset = {c: frozenset(params.keys()) for c, params in ciphers.items()}
+
 
 def cleanup():
     "Get rid of all database files"
@@ -63,11 +73,24 @@ def cleanup():
     for c in apsw.connections():
         names.append(c.filename)
         c.close()
-    gc.collect()
-    for name in names:
-        for suffix in "", "-wal", "-journal", "-shm":
-            if os.path.exists(name + suffix):
-                os.remove(name + suffix)
+    targets = {os.path.abspath(name + suffix) for name in names if name for suffix in ("", "-wal", "-journal", "-shm")}
+    for directory in {os.path.dirname(target) for target in targets}:
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            # the directory has already been removed
+            continue
+        with entries:
+            for entry in entries:
+                if entry.path in targets:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+# how many random choices permutations() and hex_keys() draw at once
+BATCH = 65536
 
 
 def permutations() -> Generator[tuple[str, tuple[str, int], tuple[str, int]], None, None]:
@@ -77,47 +100,121 @@ def permutations() -> Generator[tuple[str, tuple[str, int], tuple[str, int]], No
     where good_params are within range and should apply, and
     bad_params are out of range or do not apply"""
 
+    # local names are quicker to look up in the loop
+    _choice = random.choice
+    _choices = random.choices
+    _randint = random.randint
+    _uniform = random.uniform
+    ciphers_local = ciphers
+    all_params_local = _all_params_sorted
+    cipher_names = _cipher_names
+    sorted_choices = _sorted_choices
+    cipher_keyset = _cipher_keyset
+    param_counts = range(4)
+
     while True:
-        cipher = random.choice(tuple(ciphers.keys()))
-        good_params = []
-        bad_params = []
-        for _ in range(random.randrange(4)):
-            param = random.choice(sorted(all_params))
-            if param not in ciphers[cipher]:
-                bad_params.append((param, 0))
-            else:
-                valid = ciphers[cipher][param]
-                if isinstance(valid, set):
-                    good_params.append((param, random.choice(sorted(valid))))
+        # the categorical choices are drawn a batch at a time, with
+        # enough parameter names for the most each permutation can use
+        cipher_draws = _choices(cipher_names, k=BATCH)
+        count_draws = _choices(param_counts, k=BATCH)
+        param_draws = iter(_choices(all_params_local, k=BATCH * max(param_counts)))
+
+        for cipher, count in zip(cipher_draws, count_draws):
+            cp = ciphers_local[cipher]
+            cp_keys = cipher_keyset[cipher]
+            cp_choices = sorted_choices[cipher]
+            good_params = []
+            bad_params = []
+            for param in itertools.islice(param_draws, count):
+                if param not in cp_keys:
+                    bad_params.append((param, 0))
                 else:
-                    good_params.append((param, random.randint(*valid)))
-        yield cipher, tuple(good_params), tuple(bad_params)
+                    valid = cp[param]
+                    if isinstance(valid, set):
+                        good_params.append((param, _choice(cp_choices[param])))
+                    elif param in {"kdf_iter", "fast_kdf_iter"}:
+                        # Performance specialization for this stress loop
+                        # only.  Rekey time is dominated by the key
+                        # derivation iterations, so bias towards small
+                        # counts to cover more configurations per unit of
+                        # time.  This does not affect the security of
+                        # anything outside this script.
+                        low, high = valid
+                        val = math.floor(10 ** _uniform(math.log10(low), math.log10(high)))
+                        good_params.append((param, min(high, max(low, val))))
+                    else:
+                        good_params.append((param, _randint(*valid)))
+            yield cipher, tuple(good_params), tuple(bad_params)
+
+
+def hex_keys() -> Generator[str, None, None]:
+    """Generates random hex keys of 0 to 9 bytes
+
+    An empty key means remove encryption"""
+    while True:
+        lengths = random.choices(range(10), k=BATCH)
+        data = random.randbytes(sum(lengths)).hex()
+        offset = 0
+        for length in lengths:
+            yield data[offset : offset + length * 2]
+            offset += length * 2
 
 
 ok_messages = ("Pagesize cannot be changed for an encrypted database.",)
 
 
 def run():
+    keys = hex_keys()
     while True:
         cleanup()
-        con = apsw.Connection("mcall")
+        # only used from this thread so no mutexes are needed
+        con = apsw.Connection(
+            "mcall",
+            flags=apsw.SQLITE_OPEN_READWRITE
+            | apsw.SQLITE_OPEN_CREATE
+            | apsw.SQLITE_OPEN_NOMUTEX
+            | apsw.SQLITE_OPEN_PRIVATECACHE,
+        )
+        # This checks SQLite3MC correctness, not durability, so trade
+        # safety for speed.  WAL is not used because rekeying is not
+        # supported in WAL mode, and temp storage is already memory in
+        # this build.
+        con.pragma("synchronous", "NORMAL")
+        con.pragma("cache_size", -16384)
+        con.pragma("mmap_size", 256 * 1024 * 1024)
         con.execute("create table x(y); insert into x values(randomblob(65536))")
 
+        # the cipher and parameters stay in effect across rekeys so
+        # only issue pragmas when something changes
+        current_cipher = None
+        applied: dict[str, int] = {}
+        # vacuum rewrites the whole file so is only done occasionally
+        vacuum_counter = 0
+
         for cipher, good, bad in permutations():
-            con.pragma("cipher", cipher)
+            if cipher != current_cipher:
+                con.pragma("cipher", cipher)
+                current_cipher = cipher
+                applied.clear()
             for name, val in bad:
                 if con.pragma(name, val) == str(val):
                     breakpoint()
                     1 / 0
             for name, val in good:
-                if con.pragma(name, val) != str(val):
+                if name == "legacy":
+                    # resets the other parameters so is always applied
+                    applied.clear()
+                elif applied.get(name) == val:
+                    continue
+                # the values are all integers which SQLite3MC reports back as text
+                result = con.pragma(name, val)
+                if result is None or int(result) != val:
                     breakpoint()
                     1 / 0
-            d = {"cipher": cipher}
-            d.update({name: val for name, val in good})
-            newkey = random.randbytes(random.randrange(10)).hex()
+                applied[name] = val
+            newkey = next(keys)
             if newkey:
-                print(d)
+                print(f"cipher={cipher}", *(f"{name}={val}" for name, val in good))
             else:
                 print("Remove encryption")
             retry = False
@@ -139,12 +236,15 @@ def run():
                 retry = True
 
             if retry:
+                current_cipher = None
                 continue
 
             try:
                 con.execute("insert into x values(randomblob(?))", (random.randrange(0, 100000),))
                 con.execute("delete from x where y in (select min(y) from x)")
-                con.execute("vacuum")
+                vacuum_counter += 1
+                if vacuum_counter & 31 == 0:
+                    con.execute("vacuum")
             except Exception as exc:
                 print(f"****** Running SQL after rekey -  Unexpected exception {exc} - starting again)")
                 break
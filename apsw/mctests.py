@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import gc
 import os
 import threading
 import time
@@ -16,11 +15,23 @@ class MultipleCiphers(unittest.TestCase):
         for c in apsw.connections():
             names.append(c.filename)
             c.close()
-        gc.collect()
-        for name in names:
-            for suffix in "", "-wal", "-journal", "-shm":
-                if os.path.exists(name + suffix):
-                    os.remove(name + suffix)
+        # one directory listing instead of checking each possible file
+        targets = {
+            os.path.abspath(name + suffix) for name in names if name for suffix in ("", "-wal", "-journal", "-shm")
+        }
+        for directory in {os.path.dirname(target) for target in targets}:
+            try:
+                entries = os.scandir(directory)
+            except FileNotFoundError:
+                # the directory has already been removed
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.path in targets:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
 
     def setUp(self):
         self.cleanup()
@@ -134,8 +145,12 @@ class MultipleCiphers(unittest.TestCase):
         con2.close()
 
         def reset():
-            self.tearDown()
-            self.setUp()
+            # the configurations need a new empty database because key
+            # and hexkey only encrypt one with no content.  this is
+            # tearDown followed by setUp with a single cleanup
+            self.db.close()
+            self.cleanup()
+            self.db = apsw.Connection("mcdb")
 
         # These should all work
         for config in (
@@ -292,25 +307,26 @@ def apply_encryption(db, **kwargs):
         # keys are last
         return 100
 
+    items = sorted(kwargs.items(), key=pragma_order)
+    key_items = [item for item in items if pragma_order(item) == 100]
+
     # check only ome key present
-    if 1 != sum(1 if pragma_order(item) == 100 else 0 for item in kwargs.items()):
+    if len(key_items) != 1:
         raise ValueError("Exactly one key must be provided")
 
-    for pragma, value in sorted(kwargs.items(), key=pragma_order):
+    for pragma, value in items:
         # if the pragma was understood and in range we get the value
         # back, while key related ones return 'ok'
         expected = "ok" if pragma_order((pragma, value)) == 100 else str(value)
         if db.pragma(pragma, value) != expected:
             raise ValueError(f"Failed to configure {pragma=}")
 
-    # Try to read from the database.  If the database is encrypted and
-    # the cipher/key information is wrong you will get NotADBError
-    # because the file looks like random noise
-    db.pragma("user_version")
-
     try:
-        # try to set the user_version to the value it already has
-        # which has a side effect of populating an empty database
+        # Try to read from the database.  If the database is encrypted and
+        # the cipher/key information is wrong you will get NotADBError
+        # because the file looks like random noise.  Then try to set the
+        # user_version to the value it already has which has a side
+        # effect of populating an empty database
         with db:
             # done inside a transaction to avoid race conditions
             db.pragma("user_version", db.pragma("user_version"))
@@ -14,10 +14,35 @@ import sys
 if len(sys.argv) != 2 or not sys.argv[1].startswith("http"):
     sys.exit(usage)
 
+import os
+import shutil
 import urllib.request
 import subprocess
 import tarfile
 
+CHUNK_SIZE = 65536
+
+
+def update_file(path, new_data) -> bool:
+    """Makes the file at path have the contents of the new_data stream,
+    comparing in chunks so only the differing part onwards is written.
+    Returns True if the file was changed"""
+    with open(path, "r+b") as f:
+        while True:
+            old_chunk = f.read(CHUNK_SIZE)
+            new_chunk = new_data.read(CHUNK_SIZE)
+            if old_chunk != new_chunk:
+                break
+            if not new_chunk:
+                return False
+        # overwrite from the start of the first differing chunk
+        f.seek(-len(old_chunk), os.SEEK_CUR)
+        f.write(new_chunk)
+        shutil.copyfileobj(new_data, f, CHUNK_SIZE)
+        f.truncate()
+        return True
+
+
 # get the version tracked files
 files = set(subprocess.check_output(["git", "ls-files"], cwd="sqlite3/configure", encoding="utf8").split())
 # we don't want to overwrite our dummy file configure insists is present
@@ -33,10 +58,6 @@ with tarfile.open(mode="r:gz", fileobj=urllib.request.urlopen(sys.argv[1])) as t
         name = member.name.split("/", 1)[1]
 
         if name in files:
-            with open(f"sqlite3/configure/{name}", "rb") as file:
-                old_data = file.read()
-            new_data = tarf.extractfile(member).read()
-            if old_data != new_data:
-                print(f"Updating {file.name}")
-                with open(file.name, "wb") as file:
-                    file.write(new_data)
+            path = f"sqlite3/configure/{name}"
+            if update_file(path, tarf.extractfile(member)):
+                print(f"Updating {path}")